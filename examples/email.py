@@ -18,4 +18,4 @@ pattern = force_full(
 print(pattern)
 
 # Generates
-# ^(?P<name>[\da-zA-Z._%+-]+)@(?P<domain>[\d\w.-]+\.[a-zA-Z]{2,})$
+# ^(?P<name>[\da-zA-Z._%+\-]+)@(?P<domain>[\d\w.-]+\.[a-zA-Z]{2,})$
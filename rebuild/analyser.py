@@ -1,78 +1,202 @@
 
+import os
 import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import ClassVar, cast
 from ordered_set import OrderedSet
 
+# Optional, faster regex engines
+try:
+    import regex as regex_module  # type: ignore
+except ImportError:
+    regex_module = None
+
+try:
+    import re2  # type: ignore
+except ImportError:
+    re2 = None
+
+
+# Kinds of nodes: Every RegexNode class has a unique _kind, which is cheaper to compare than its type
+EMPTY = 0
+SEQUENCE = 1
+ALTERNATION = 2
+SINGLE_CHAR = 3
+ONE_OR_MORE = 4
+ZERO_OR_MORE = 5
+OPTIONAL = 6
+CAPTURING_GROUP = 7
+NON_CAPTURING_GROUP = 8
+NAMED_CAPTURING_GROUP = 9
+MODE_GROUP = 10
+IF_ELSE_GROUP = 11
+LOOKAROUND = 12
+ANCHOR_START = 13
+ANCHOR_END = 14
+CHAR_SET = 15
+RANGE = 16
+REPEAT_EXACTLY_N = 17
+REPEAT_AT_LEAST_N = 18
+REPEAT_AT_MOST_N = 19
+REPEAT_BETWEEN_N_M = 20
+LITERAL = 21
+
+_QUANTIFIERS = (ONE_OR_MORE, ZERO_OR_MORE, OPTIONAL)
+
+_LIST_TYPES = (list, tuple)
+
+# Characters with a special meaning outside of char sets
+_METACHARS = ".^$*+?{}[]\\|()"
+
 
 class RegexNode:
+    # Nodes are created in large numbers, so they do not have a __dict__
+    __slots__ = ("_regex_cache", "_hash")
+
+    # Every node starts without a cache, which is only created once regex() is called on it
+    _regex_cache: "dict[tuple[bool, bool], str] | None"
+    _hash: "int | None"
+
+    _kind: ClassVar[int] = -1
+
+    # Names of the public fields of a node, in the order they are displayed
+    _fields: ClassVar["tuple[str, ...]"] = ()
+
+    # Names of the fields in the order of the constructor arguments, if it differs from _fields
+    _constructor_fields: ClassVar["tuple[str, ...] | None"] = None
+
+    # Whether the pattern is a single unit, that can be quantified without a group, e.g. a, [abc], (abc)
+    is_atom: bool = False
+
     def optimised(self) -> "RegexNode":
         return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return ""
+    def regex(self, as_atom: bool = False, in_sequence: bool = True) -> str:
+        # Nodes are not modified after they have been built, so the pattern
+        # of each node only needs to be generated once per set of arguments
+        cache = self._regex_cache
+        key = (as_atom, in_sequence)
+
+        if cache is None:
+            cache = self._regex_cache = {}
+        else:
+            pattern = cache.get(key)
+            if pattern is not None:
+                return pattern
+
+        # The whole subtree writes into a single buffer, which is only joined once
+        buffer: "list[str]" = []
+        self._emit(buffer, as_atom, in_sequence)
+        pattern = cache[key] = "".join(buffer)
+        return pattern
 
-    def __str__(self):
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        """Appends the chunks of the pattern of this node to the buffer"""
+        pass
+
+    def __str__(self) -> str:
         return str(self.as_json())
 
-    def __eq__(self, other):
+    def __eq__(self, other: object) -> bool:
         if self is other:
             return True
 
         if type(self) is not type(other):
             return False
 
-        own_fields = tuple((k, v) for k, v in self.__dict__.items() if not k.startswith("_"))
-        other_fields = tuple((k, v) for k, v in other.__dict__.items() if not k.startswith("_"))
+        # Cheap for nodes, that have been compared or hashed before
+        if hash(self) != hash(other):
+            return False
+
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        # The hash of a node depends on its whole subtree, so it is only computed once
+        try:
+            node_hash = self._hash
+        except AttributeError:
+            node_hash = None
+
+        if node_hash is None:
+            node_hash = self._hash = hash((self._kind,) + self._key())
 
-        return own_fields == other_fields
+        return node_hash
 
-    def __hash__(self):
-        return hash(tuple(
-            (k, tuple(v) if type(v) is list else v)
-            for k, v in self.__dict__.items()
-            if not k.startswith("_")
-        ))
+    def _key(self):
+        """The values of all public fields, which define the identity of the node"""
+        return tuple(
+            tuple(value) if type(value) is list else value
+            for value in (getattr(self, field) for field in self._fields)
+        )
 
-    def __bool__(self):
+    def __reduce__(self):
+        # Nodes are pickled as their constructor arguments, so that cached values (hashes of strings
+        # differ between processes) are left out, and interned nodes stay interned
+        fields = self._fields if self._constructor_fields is None else self._constructor_fields
+        return type(self), tuple(getattr(self, field) for field in fields)
+
+    def __bool__(self) -> bool:
         return True
 
     def as_json(self):
-        # Automatically generate a tree structure for this object
+        # Automatically generate a tree structure for this object.
+        # The tree is walked with explicit stacks instead of recursion (post-order):
+        # "to_visit" holds the work that is left, "results" the json of every finished value
+        to_visit = [(_VISIT, self)]
+        results = []
 
-        def json_for(value):
-            """Creates a json like structure for the given object """
-            if isinstance(value, RegexNode):
-                if type(value) is EmptyNode:
-                    return None
-                return value.as_json()
+        while to_visit:
+            action, value = to_visit.pop()
 
-            if type(value) in (list, tuple):
-                return [json_for(item) for item in value]
+            if action == _VISIT:
+                if isinstance(value, RegexNode):
+                    if value._kind == EMPTY:
+                        results.append(None)
+                        continue
 
-            if type(value) is str:
-                return "\"" + value + "\""
+                    to_visit.append((_BUILD_NODE, value))
+                    to_visit.extend((_VISIT, getattr(value, field)) for field in reversed(value._fields))
 
-            return str(value)
+                elif isinstance(value, _LIST_TYPES):
+                    to_visit.append((_BUILD_LIST, len(value)))
+                    to_visit.extend((_VISIT, item) for item in reversed(value))
 
-        def prettify_varname(name):
-            return name.replace("_", " ").title()
+                elif type(value) is str:
+                    results.append("\"" + value + "\"")
 
-        def prettify_classname(name):
-            return re.sub(r"(?<=[a-z])([A-Z])", r" \1", name)
+                else:
+                    results.append(str(value))
+
+                continue
+
+            # The json of the children are the last items on the results stack
+            count = value if action == _BUILD_LIST else len(value._fields)
+            children = results[len(results) - count:]
+            del results[len(results) - count:]
+
+            if action == _BUILD_LIST:
+                results.append(children)
+            else:
+                results.append(value._json_from_fields(children))
 
-        # Find all properties / fields of the object
-        fields = [field for field in vars(self) if not field.startswith("_")]
+        return results[0]
+
+    def _json_from_fields(self, values):
+        """Creates the json like structure of this node, given the json of each of its fields"""
 
         # Get the name of the object's class
-        name = prettify_classname(self.__class__.__name__)
+        name = _prettify_classname(self.__class__.__name__)
 
         # E.g. for EmptyNode
-        if len(fields) == 0:
+        if len(self._fields) == 0:
             return name
 
         # If there is only one field, then ignore the name of the field
-        if len(fields) == 1:
-            value = getattr(self, fields[0])
-            subtree = json_for(value)
+        if len(self._fields) == 1:
+            subtree = values[0]
 
             if type(subtree) is str:
                 return name + ": " + subtree
@@ -81,18 +205,15 @@ class RegexNode:
 
         subtree = {}
 
-        for field in fields:
-            value = getattr(self, field)
-            value_json = json_for(value)
-
+        for field, value_json in zip(self._fields, values):
             if value_json is None:
                 # EmptyNode
-                subtree[prettify_varname(field) + ": ---"] = None
+                subtree[_prettify_varname(field) + ": ---"] = None
 
             elif type(value_json) is str:
-                subtree[prettify_varname(field) + ": " + value_json] = None
+                subtree[_prettify_varname(field) + ": " + value_json] = None
             else:
-                subtree[prettify_varname(field)] = value_json
+                subtree[_prettify_varname(field)] = value_json
 
         return {name: subtree}
 
@@ -100,74 +221,298 @@ class RegexNode:
         tree = self.as_json()
         _print_pretty_tree(tree)
 
+    def descendants(self):
+        """Yields this node and every node below it"""
+        stack = [self]
 
-def _ipretty_tree(tree, depth=0):
-    indentation = "|   " * depth
+        while stack:
+            value = stack.pop()
 
-    if type(tree) is list:
-        for item in tree:
-            yield from _ipretty_tree(item, depth)
-        return
+            if isinstance(value, RegexNode):
+                yield value
+                stack.extend(getattr(value, field) for field in value._fields)
 
-    if type(tree) is dict:
-        for name, subtree in tree.items():
-            yield indentation + name
-            if (type(subtree) is str and len(subtree) == 0) or subtree is None:
-                continue
-            yield from _ipretty_tree(subtree, depth + 1)
-        return
+            elif isinstance(value, _LIST_TYPES):
+                stack.extend(value)
+
+    def _is_re2_compatible(self):
+        for node in self.descendants():
+            if node._kind in (LOOKAROUND, IF_ELSE_GROUP):
+                return False
+
+            # RE2 only supports the inline flags i, m and s, e.g. not (?x:...)
+            if node._kind == MODE_GROUP and not set(node.modifiers) <= set("ims"):
+                return False
+
+        return True
+
+    def compile(self, flags=0, engine="re"):
+        """Compiles the pattern of this node. Compiled patterns are cached, so calling this again is cheap
+
+        engine can be one of:
+        - "re": The standard library
+        - "regex": The third party regex module
+        - "re2": Google's RE2, which does not support lookarounds, conditionals and some inline flags
+        - "auto": RE2 if the pattern and flags allow it, else regex, else re, depending on what is installed
+
+        Note that \\d, \\w and \\s only match ASCII chars in RE2, so with "auto" a pattern
+        can match differently than with re on str input.
+        """
+        pattern = self.regex()
+
+        if engine == "auto":
+            if re2 is not None and flags == 0 and self._is_re2_compatible():
+                return _compile_preferring_re2(pattern)
+
+            engine = _FALLBACK_ENGINE
+
+        return _compile(pattern, flags, engine)
+
+    def match(self, string, flags=0, engine="re"):
+        return self.compile(flags, engine).match(string)
+
+    def search(self, string, flags=0, engine="re"):
+        return self.compile(flags, engine).search(string)
 
-    yield indentation + str(tree)
+    def finditer(self, string, flags=0, engine="re"):
+        return self.compile(flags, engine).finditer(string)
+
+
+# Below this number of trees, starting the worker processes takes longer than building the patterns
+PARALLEL_BUILD_THRESHOLD = 100
+
+
+def build_many(roots, workers=None):
+    """Optimises each tree and converts it to a pattern. Large batches are built in parallel processes"""
+    roots = list(roots)
+    workers = workers or os.cpu_count() or 1
+
+    if len(roots) < PARALLEL_BUILD_THRESHOLD or workers == 1:
+        return [_build_one(root) for root in roots]
+
+    chunksize = max(1, len(roots) // (4 * workers))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_build_one, roots, chunksize=chunksize))
+
+
+def _build_one(root):
+    return root.optimised().regex()
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern, flags, engine):
+    if engine == "re":
+        return re.compile(pattern, flags)
+
+    if engine == "regex":
+        if regex_module is None:
+            raise ImportError("The regex engine requires the regex module")
+        return regex_module.compile(pattern, flags)
+
+    if engine == "re2":
+        if re2 is None:
+            raise ImportError("The re2 engine requires the google-re2 module")
+        if flags != 0:
+            raise ValueError("The re2 engine does not support flags")
+        return re2.compile(pattern)
+
+    raise ValueError(f"Unknown regex engine: {engine}")
+
+
+# The engine used by "auto", if RE2 can not be used
+_FALLBACK_ENGINE = "regex" if regex_module is not None else "re"
+
+
+@lru_cache(maxsize=256)
+def _compile_preferring_re2(pattern):
+    # The fallback is cached as well, so that RE2 does not reject the same pattern again on every call
+    try:
+        return re2.compile(pattern)
+    except re2.error:
+        return _compile(pattern, 0, _FALLBACK_ENGINE)
+
+
+# Actions of the work stack in RegexNode.as_json
+_VISIT, _BUILD_LIST, _BUILD_NODE = range(3)
+
+
+_CAMEL_CASE_BOUNDARY = re.compile(r"(?<=[a-z])([A-Z])")
+
+# There are only a few different classes and fields, so their pretty names are only generated once
+_PRETTY_VARNAMES: "dict[str, str]" = {}
+_PRETTY_CLASSNAMES: "dict[str, str]" = {}
+
+
+def _prettify_varname(name: str) -> str:
+    pretty_name = _PRETTY_VARNAMES.get(name)
+
+    if pretty_name is None:
+        pretty_name = _PRETTY_VARNAMES[name] = name.replace("_", " ").title()
+
+    return pretty_name
+
+
+def _prettify_classname(name: str) -> str:
+    pretty_name = _PRETTY_CLASSNAMES.get(name)
+
+    if pretty_name is None:
+        pretty_name = _PRETTY_CLASSNAMES[name] = _CAMEL_CASE_BOUNDARY.sub(r" \1", name)
+
+    return pretty_name
 
 
 def _print_pretty_tree(tree, depth=0):
-    indentation = "|   " * depth
+    # Uses an explicit stack of (depth, subtree) instead of recursion
+    stack = deque([(depth, tree)])
+    lines = []
 
-    if type(tree) is list:
-        for item in tree:
-            _print_pretty_tree(item, depth)
-        return
+    while stack:
+        depth, tree = stack.pop()
 
-    if type(tree) is dict:
-        for name, subtree in tree.items():
-            print(indentation + name)
-            if (type(subtree) is str and len(subtree) == 0) or subtree is None:
-                continue
-            _print_pretty_tree(subtree, depth+1)
+        if type(tree) is list:
+            stack.extend((depth, item) for item in tree[::-1])
+            continue
+
+        if type(tree) is dict:
+            # Pushed in reverse, so that each name is popped right before its subtree
+            for name, subtree in reversed(list(tree.items())):
+                if not ((type(subtree) is str and len(subtree) == 0) or subtree is None):
+                    stack.append((depth + 1, subtree))
+                stack.append((depth, name))
+            continue
+
+        lines.append("|   " * depth + str(tree))
+
+    # Write the whole tree at once instead of printing every line separately
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
+
+
+def _are_same_nodes(nodes, other_nodes):
+    """Whether both lists contain the very same node objects, i.e. optimising did not change anything"""
+    return len(nodes) == len(other_nodes) and all(node is other for node, other in zip(nodes, other_nodes))
+
+
+def _emit_quantified(buffer: list, pattern: "RegexNode", quantifier: str, is_lazy: bool, as_atom: bool):
+    """Appends pattern followed by a quantifier like + or {2,} to the buffer"""
+    start = len(buffer)
+
+    if as_atom:
+        buffer.append("(?:")
+
+    pattern._emit(buffer, as_atom=not pattern.is_atom)
+
+    # Quantifying an empty pattern results in an empty pattern. The last chunk is
+    # checked first, as it is hardly ever empty
+    end = start + as_atom
+    if len(buffer) == end or (not buffer[-1] and not any(buffer[end:])):
+        del buffer[start:]
         return
 
-    print(indentation + str(tree))
+    buffer.append(quantifier)
+
+    if is_lazy:
+        buffer.append("?")
+
+    if as_atom:
+        buffer.append(")")
 
 
 class EmptyNode (RegexNode):
+    _kind = EMPTY
+    __slots__ = ()
+    _instance: ClassVar["EmptyNode | None"] = None
+
+    def __new__(cls):
+        # Empty nodes have no state, so they can all share one instance
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._regex_cache = None
+        return cls._instance
+
     def as_json(self):
         return "Empty"
 
-    def __bool__(self):
+    def __bool__(self) -> bool:
         return False
 
 
+EMPTY_NODE = EmptyNode()
+
+
 class Sequence (RegexNode):
-    def __init__(self, items):
+    _kind = SEQUENCE
+    _fields = ("items",)
+    __slots__ = _fields
+
+    def __init__(self, items: list):
         self.items = items
+        self._regex_cache = None
+
+    def _flatten_sequences(self, items):
+        """Flatten nested sequences a(?:bc)d --> abcd"""
+
+        simplified = []
+        for item in items:
+            if item._kind == SEQUENCE:
+                simplified.extend(item.items)
+                continue
+
+            simplified.append(item)
+
+        return simplified
+
+    def _join_literals(self, items):
+        """Merge runs of literal characters into a single node
+        a, b, c, [0-9] --> abc, [0-9]
+        """
+        joined = []
+        run = []
+
+        for item in items + [None]:
+            if item is not None and (item._kind == LITERAL or (item._kind == SINGLE_CHAR and item.is_literal)):
+                run.append(item)
+                continue
+
+            if len(run) == 1:
+                joined.append(run[0])
+            elif len(run) > 1:
+                joined.append(Literal("".join(node.regex() for node in run)))
+
+            run = []
+
+            if item is not None:
+                joined.append(item)
+
+        return joined
 
     def optimised(self) -> "RegexNode":
         optimised = [item.optimised() for item in self.items]
         non_empty = list(filter(None, optimised))
+        non_empty = self._flatten_sequences(non_empty)
+        non_empty = self._join_literals(non_empty)
 
         if len(non_empty) == 0:
-            return EmptyNode()
+            return EMPTY_NODE
 
         if len(non_empty) == 1:
             return non_empty[0]
 
+        if _are_same_nodes(non_empty, self.items):
+            return self
+
         return Sequence(non_empty)
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        pattern = "".join(item.regex() for item in self.items)
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
         if as_atom:
-            return "(?:" + pattern + ")"
-        return pattern
+            buffer.append("(?:")
+
+        for item in self.items:
+            item._emit(buffer)
+
+        if as_atom:
+            buffer.append(")")
 
 
 # TODO: Factor out common subexpressions in sequences
@@ -178,8 +523,13 @@ class Sequence (RegexNode):
 # TODO: Remove redundant items after empties
 # (?:a||b|c) --> (?:a|)
 class Alternation (RegexNode):
-    def __init__(self, options):
+    _kind = ALTERNATION
+    _fields = ("options",)
+    __slots__ = _fields
+
+    def __init__(self, options: list):
         self.options = options
+        self._regex_cache = None
 
     def _remove_duplicates(self, options):
         return list(OrderedSet(options))
@@ -189,7 +539,7 @@ class Alternation (RegexNode):
 
         simplified = []
         for item in options:
-            if type(item) is Alternation:
+            if item._kind == ALTERNATION:
                 simplified.extend(item.options)
                 continue
 
@@ -240,347 +590,829 @@ class Alternation (RegexNode):
         if len(optimised) == 1:
             return optimised[0]
 
+        if _are_same_nodes(optimised, self.options):
+            return self
+
         return Alternation(optimised)
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        pattern = "|".join(option.regex() for option in self.options)
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        if in_sequence:
+            buffer.append("(?:")
+
+        for index, option in enumerate(self.options):
+            if index > 0:
+                buffer.append("|")
+            option._emit(buffer)
+
+        if in_sequence:
+            buffer.append(")")
+
 
-        if not in_sequence:
-            return pattern
-        return f"(?:{pattern})"
+_SINGLE_CHARS: "dict[str, SingleChar]" = {}
 
 
 class SingleChar (RegexNode):
-    def __init__(self, char):
-        self.char = char
+    _kind = SINGLE_CHAR
+    is_atom = True
+    _fields = ("char",)
+    __slots__ = _fields
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return self.char
+    char: str
 
+    def __new__(cls, char: str):
+        # Chars are never modified, so every char only needs a single instance
+        node = _SINGLE_CHARS.get(char)
 
-class OneOrMore (RegexNode):
-    def __init__(self, pattern, is_lazy=False):
-        self.is_lazy = is_lazy
-        self.pattern = pattern
+        if node is None:
+            node = _SINGLE_CHARS[char] = super().__new__(cls)
+            node.char = char
+            node._regex_cache = None
 
-    def optimised(self) -> "RegexNode":
-        optimised = self.pattern.optimised()
+        return node
 
-        if type(optimised) is EmptyNode:
-            return EmptyNode()
+    @property
+    def is_literal(self) -> bool:
+        """Whether the char only matches itself, e.g. a or \\. but not . or \\d"""
+        if len(self.char) == 1:
+            return self.char not in _METACHARS
 
-        if type(optimised) in (ZeroOrMore, Optional, OneOrMore):
-            return OneOrMore(optimised.pattern, self.is_lazy)
+        if self.char[0] != "\\":
+            return False
 
-        return OneOrMore(optimised, self.is_lazy)
+        # \xFF or \u0000
+        if self.char[1] in "xu":
+            return True
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        if type(self.pattern) is EmptyNode:
-            return ""
+        return not self.char[1].isalnum()
 
-        regex = self.pattern.regex(as_atom=True) + "+"
+    @property
+    def can_be_in_char_set(self) -> bool:
+        """Whether the char keeps its meaning inside of a char set, e.g. a or \\d but not . or \\b"""
+        if self.is_literal:
+            return True
 
-        if self.is_lazy:
-            regex += "?"
+        return len(self.char) == 2 and self.char[0] == "\\" and self.char[1] in "dwsDWSntrfv"
 
+    def in_char_set(self) -> "SingleChar":
+        """Returns the char escaped for use inside of a char set, e.g. - --> \\-"""
+        if len(self.char) == 1 and self.char in _CHAR_SET_METACHARS:
+            return SingleChar("\\" + self.char)
+        return self
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.append(self.char)
+
+
+class Literal (RegexNode):
+    """A string of at least two literal characters, which always has to be matched as a whole"""
+
+    _kind = LITERAL
+    _fields = ("text",)
+    __slots__ = _fields
+
+    def __init__(self, text: str):
+        self.text = text
+        self._regex_cache = None
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
         if as_atom:
-            return f"(?:{regex})"
+            buffer.extend(("(?:", self.text, ")"))
+        else:
+            buffer.append(self.text)
 
-        return regex
 
+class OneOrMore (RegexNode):
+    _kind = ONE_OR_MORE
+    _fields = ("is_lazy", "pattern")
+    __slots__ = _fields
+    _constructor_fields = ("pattern", "is_lazy")
 
-class ZeroOrMore (RegexNode):
-    def __init__(self, pattern, is_lazy=False):
+    def __init__(self, pattern: "RegexNode", is_lazy: bool = False):
         self.is_lazy = is_lazy
         self.pattern = pattern
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
         optimised = self.pattern.optimised()
 
-        if type(optimised) is EmptyNode:
-            return EmptyNode()
-
-        if type(optimised) in (ZeroOrMore, Optional, OneOrMore):
-            return ZeroOrMore(optimised.pattern, self.is_lazy)
+        if optimised._kind == EMPTY:
+            return EMPTY_NODE
 
-        return ZeroOrMore(optimised, self.is_lazy)
+        if optimised._kind in _QUANTIFIERS:
+            return OneOrMore(cast("OneOrMore | ZeroOrMore | Optional", optimised).pattern, self.is_lazy)
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        if type(self.pattern) is EmptyNode:
-            return ""
+        if optimised is self.pattern:
+            return self
 
-        regex = self.pattern.regex(as_atom=True) + "*"
+        return OneOrMore(optimised, self.is_lazy)
 
-        if self.is_lazy:
-            regex += "?"
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "+", self.is_lazy, as_atom)
 
-        if as_atom:
-            return f"(?:{regex})"
-
-        return regex
 
+class ZeroOrMore (RegexNode):
+    _kind = ZERO_OR_MORE
+    _fields = ("is_lazy", "pattern")
+    __slots__ = _fields
+    _constructor_fields = ("pattern", "is_lazy")
 
-class Optional (RegexNode):
-    def __init__(self, pattern, is_lazy=False):
+    def __init__(self, pattern: "RegexNode", is_lazy: bool = False):
         self.is_lazy = is_lazy
         self.pattern = pattern
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
         optimised = self.pattern.optimised()
 
-        if type(optimised) is EmptyNode:
-            return EmptyNode()
+        if optimised._kind == EMPTY:
+            return EMPTY_NODE
 
-        return Optional(optimised, self.is_lazy)
+        if optimised._kind in _QUANTIFIERS:
+            return ZeroOrMore(cast("OneOrMore | ZeroOrMore | Optional", optimised).pattern, self.is_lazy)
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        if type(self.pattern) is EmptyNode:
-            return ""
+        if optimised is self.pattern:
+            return self
 
-        regex = self.pattern.regex(as_atom=True) + "?"
+        return ZeroOrMore(optimised, self.is_lazy)
 
-        if self.is_lazy:
-            regex += "?"
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "*", self.is_lazy, as_atom)
 
-        if as_atom:
-            return f"(?:{regex})"
 
-        return regex
+class Optional (RegexNode):
+    _kind = OPTIONAL
+    _fields = ("is_lazy", "pattern")
+    __slots__ = _fields
+    _constructor_fields = ("pattern", "is_lazy")
+
+    def __init__(self, pattern: "RegexNode", is_lazy: bool = False):
+        self.is_lazy = is_lazy
+        self.pattern = pattern
+        self._regex_cache = None
+
+    def optimised(self) -> "RegexNode":
+        optimised = self.pattern.optimised()
+
+        if optimised._kind == EMPTY:
+            return EMPTY_NODE
+
+        if optimised is self.pattern:
+            return self
+
+        return Optional(optimised, self.is_lazy)
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "?", self.is_lazy, as_atom)
 
 
 class CapturingGroup (RegexNode):
-    def __init__(self, pattern):
+    _kind = CAPTURING_GROUP
+    is_atom = True
+    _fields = ("pattern",)
+    __slots__ = _fields
+
+    def __init__(self, pattern: "RegexNode"):
         self.pattern = pattern
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        return CapturingGroup(self.pattern.optimised())
+        optimised = self.pattern.optimised()
+
+        if optimised is self.pattern:
+            return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return f"({self.pattern.regex(in_sequence=False)})"
+        return CapturingGroup(optimised)
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.append("(")
+        self.pattern._emit(buffer, in_sequence=False)
+        buffer.append(")")
 
 
 class NonCapturingGroup (RegexNode):
-    def __init__(self, pattern):
+    _kind = NON_CAPTURING_GROUP
+    is_atom = True
+    _fields = ("pattern",)
+    __slots__ = _fields
+
+    def __init__(self, pattern: "RegexNode"):
         self.pattern = pattern
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
         return self.pattern.optimised()
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return f"(?:{self.pattern.regex(in_sequence=False)})"
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.append("(?:")
+        self.pattern._emit(buffer, in_sequence=False)
+        buffer.append(")")
 
 
 class NamedCapturingGroup (RegexNode):
-    def __init__(self, name, pattern):
+    _kind = NAMED_CAPTURING_GROUP
+    is_atom = True
+    _fields = ("name", "pattern")
+    __slots__ = _fields
+
+    def __init__(self, name: str, pattern: "RegexNode"):
         self.name = name
         self.pattern = pattern
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        return NamedCapturingGroup(self.name, self.pattern.optimised())
+        optimised = self.pattern.optimised()
+
+        if optimised is self.pattern:
+            return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return f"(?P<{self.name}>{self.pattern.regex(in_sequence=False)})"
+        return NamedCapturingGroup(self.name, optimised)
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.extend(("(?P<", self.name, ">"))
+        self.pattern._emit(buffer, in_sequence=False)
+        buffer.append(")")
 
 
 class ModeGroup (RegexNode):
-    def __init__(self, modifiers, pattern):
+    _kind = MODE_GROUP
+    _fields = ("modifiers", "pattern")
+    __slots__ = _fields + ("is_atom",)
+
+    def __init__(self, modifiers: str, pattern: "RegexNode"):
         self.modifiers = modifiers
         self.pattern = pattern
+        self._regex_cache = None
+
+        # Without modifiers, only the pattern itself is written
+        self.is_atom = len(modifiers) > 0 or pattern.is_atom
 
     def optimised(self) -> "RegexNode":
-        if type(self.pattern) is EmptyNode:
-            return EmptyNode()
+        if self.pattern._kind == EMPTY:
+            return EMPTY_NODE
 
         if len(self.modifiers) == 0:
             return self.pattern.optimised()
 
-        return ModeGroup(self.modifiers, self.pattern.optimised())
+        optimised = self.pattern.optimised()
+
+        if optimised is self.pattern:
+            return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        if type(self.pattern) is EmptyNode:
-            return ""
+        return ModeGroup(self.modifiers, optimised)
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        if self.pattern._kind == EMPTY:
+            return
 
         if len(self.modifiers) == 0:
-            return self.pattern.regex(as_atom=as_atom)
+            self.pattern._emit(buffer, as_atom=as_atom)
+            return
 
-        return f"(?{self.modifiers}:{self.pattern.regex(in_sequence=False)})"
+        buffer.extend(("(?", self.modifiers, ":"))
+        self.pattern._emit(buffer, in_sequence=False)
+        buffer.append(")")
 
 
 class IfElseGroup (RegexNode):
-    def __init__(self, name, then, elsewise):
+    _kind = IF_ELSE_GROUP
+    is_atom = True
+    _fields = ("name", "then", "elsewise")
+    __slots__ = _fields
+
+    def __init__(self, name: str, then: "RegexNode", elsewise: "RegexNode"):
         self.name = name
         self.then = then
         self.elsewise = elsewise
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        if type(self.then) is EmptyNode and type(self.elsewise) is EmptyNode:
-            return EmptyNode()
-        return IfElseGroup(self.name, self.then.optimised(), self.elsewise.optimised())
+        if self.then._kind == EMPTY and self.elsewise._kind == EMPTY:
+            return EMPTY_NODE
+
+        then = self.then.optimised()
+        elsewise = self.elsewise.optimised()
+
+        if then is self.then and elsewise is self.elsewise:
+            return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return f"(?({self.name}){self.then.regex()}|{self.elsewise.regex()})"
+        return IfElseGroup(self.name, then, elsewise)
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.extend(("(?(", self.name, ")"))
+        self.then._emit(buffer)
+        buffer.append("|")
+        self.elsewise._emit(buffer)
+        buffer.append(")")
 
 
 class Lookaround (RegexNode):
-    def __init__(self, pattern, symbol="="):
+    _kind = LOOKAROUND
+    is_atom = True
+    _fields = ("pattern",)
+    __slots__ = _fields + ("_symbol",)
+    _constructor_fields: ClassVar["tuple[str, ...] | None"] = ("pattern", "_symbol")
+
+    def __init__(self, pattern: "RegexNode", symbol: str = "="):
         self.pattern = pattern
         self._symbol = symbol
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        if type(self.pattern) is EmptyNode:
-            return EmptyNode()
-        return Lookaround(self.pattern.optimised(), self._symbol)
+        if self.pattern._kind == EMPTY:
+            return EMPTY_NODE
+
+        optimised = self.pattern.optimised()
+
+        if optimised is self.pattern:
+            return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return f"(?{self._symbol}{self.pattern.regex(in_sequence=False)})"
+        return Lookaround(optimised, self._symbol)
+
+    def _key(self):
+        # (?=a) and (?!a) only differ in their symbol
+        return super()._key() + (self._symbol,)
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.extend(("(?", self._symbol))
+        self.pattern._emit(buffer, in_sequence=False)
+        buffer.append(")")
 
 
 class Lookahead (Lookaround):
-    def __init__(self, pattern):
+    __slots__ = ()
+    _constructor_fields = ("pattern",)
+
+    def __init__(self, pattern: "RegexNode"):
         super().__init__(pattern, "=")
 
 
 class NegativeLookahead (Lookaround):
-    def __init__(self, pattern):
+    __slots__ = ()
+    _constructor_fields = ("pattern",)
+
+    def __init__(self, pattern: "RegexNode"):
         super().__init__(pattern, "!")
 
 
 class Lookbehind (Lookaround):
-    def __init__(self, pattern):
+    __slots__ = ()
+    _constructor_fields = ("pattern",)
+
+    def __init__(self, pattern: "RegexNode"):
         super().__init__(pattern, "<=")
 
 
 class NegativeLookbehind (Lookaround):
-    def __init__(self, pattern):
+    __slots__ = ()
+    _constructor_fields = ("pattern",)
+
+    def __init__(self, pattern: "RegexNode"):
         super().__init__(pattern, "<!")
 
 
 class AnchorStart (RegexNode):
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return "^"
+    _kind = ANCHOR_START
+    __slots__ = ()
+    is_atom = True
+    _instance: ClassVar["AnchorStart | None"] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._regex_cache = None
+        return cls._instance
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.append("^")
 
 
 class AnchorEnd (RegexNode):
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return "$"
+    _kind = ANCHOR_END
+    __slots__ = ()
+    is_atom = True
+    _instance: ClassVar["AnchorEnd | None"] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._regex_cache = None
+        return cls._instance
+
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.append("$")
+
+
+# Ranges are only valid within one of these classes of chars, e.g. a-z or 0-9
+_RANGE_CLASSES = ((ord("0"), ord("9")), (ord("A"), ord("Z")), (ord("a"), ord("z")))
+
+
+def _range_class(code_point: int):
+    for index, (lo, hi) in enumerate(_RANGE_CLASSES):
+        if lo <= code_point <= hi:
+            return index
+    return None
+
+
+def _code_point(char: str):
+    """Returns the code point of a char in a char set, or None if it is a class like \\d"""
+    if len(char) == 1:
+        return ord(char)
+
+    if char[0] != "\\":
+        return None
+
+    # \xFF or \u0000
+    if char[1] in "xu":
+        return int(char[2:], 16)
+
+    if not char[1].isalnum():
+        return ord(char[1])
+
+    return None
+
+
+def _bounds_of(option):
+    """Returns the (lowest, highest) code point matched by an option of a char set,
+    or None if it can not be merged with other options
+    """
+    if option._kind == SINGLE_CHAR:
+        code_point = _code_point(option.char)
+        if code_point is None:
+            return None
+        return code_point, code_point
+
+    if option._kind == RANGE:
+        lo = _code_point(option.from_char)
+        hi = _code_point(option.to_char)
+        if lo is None or hi is None:
+            return None
+        return lo, hi
+
+    return None
+
+
+def _is_raw_dash(option) -> bool:
+    return option._kind == SINGLE_CHAR and option.char == "-"
+
+
+def _explicit_ranges(options):
+    """Replaces a raw - between two chars of a char set with a range, e.g. [*-0] --> Range("*", "0").
+    The parser only creates ranges like a-z, A-Z or 0-9, so other ranges reach the analyser as single chars.
+    Returns None if a range can not be converted
+    """
+    converted = []
+    index = 0
+
+    while index < len(options):
+        option = options[index]
+
+        # A - directly after a range is a literal, e.g. [a-z-9]
+        if _is_raw_dash(option) and 0 < index < len(options) - 1 and converted[-1]._kind == SINGLE_CHAR:
+            from_char = converted[-1]
+            to_char = options[index + 1]
+
+            if to_char._kind != SINGLE_CHAR \
+                    or _code_point(from_char.char) is None or _code_point(to_char.char) is None:
+                return None
+
+            converted[-1] = Range(from_char.char, to_char.char)
+            index += 2
+            continue
+
+        converted.append(option)
+        index += 1
+
+    return converted
+
+
+def _has_unparsed_range(options) -> bool:
+    """Whether a raw - between two options of a char set spans a range, that the parser did not create"""
+    return any(_is_raw_dash(option) for option in options[1:-1])
+
+
+def _intervals_of(options):
+    """Returns the sorted, disjoint (lowest, highest) code point intervals matched by the options,
+    or None if one of the options can not be converted, e.g. \\d
+    """
+    bounds = []
+
+    for option in options:
+        option_bounds = _bounds_of(option)
+        if option_bounds is None:
+            return None
+        bounds.append(option_bounds)
+
+    bounds.sort()
+    intervals = []
+
+    for lo, hi in bounds:
+        if intervals and lo <= intervals[-1][1] + 1:
+            intervals[-1] = (intervals[-1][0], max(intervals[-1][1], hi))
+        else:
+            intervals.append((lo, hi))
+
+    return intervals
+
+
+def _intersect_intervals(first, second):
+    intersection = []
+
+    for first_lo, first_hi in first:
+        for second_lo, second_hi in second:
+            lo = max(first_lo, second_lo)
+            hi = min(first_hi, second_hi)
+            if lo <= hi:
+                intersection.append((lo, hi))
+
+    return sorted(intersection)
+
+
+def _subtract_intervals(intervals, removed):
+    difference = []
+
+    for lo, hi in intervals:
+        for removed_lo, removed_hi in removed:
+            if removed_hi < lo or removed_lo > hi:
+                continue
+
+            if removed_lo > lo:
+                difference.append((lo, removed_lo - 1))
+            lo = removed_hi + 1
+
+        if lo <= hi:
+            difference.append((lo, hi))
+
+    return difference
+
+
+# Chars that have to be escaped within char sets
+_CHAR_SET_METACHARS = "\\]^-[$"
+
+
+def _escaped_in_char_set(code_point: int) -> str:
+    char = chr(code_point)
+
+    if code_point < 32 or code_point == 127:
+        return "\\x" + format(code_point, "02x")
+
+    if char in _CHAR_SET_METACHARS:
+        return "\\" + char
+
+    return char
+
+
+def _options_for(intervals):
+    """Creates the options of a char set, that matches exactly the given code point intervals"""
+    options = []
+
+    for lo, hi in intervals:
+        while lo <= hi:
+            # Ranges can not go beyond a-z, A-Z or 0-9
+            range_class = _range_class(lo)
+            end = lo if range_class is None else min(hi, _RANGE_CLASSES[range_class][1])
+
+            if end - lo >= 3:
+                options.append(Range(chr(lo), chr(end)))
+            else:
+                options.extend(SingleChar(_escaped_in_char_set(code_point)) for code_point in range(lo, end + 1))
+
+            lo = end + 1
+
+    return options
 
 
 class CharSet (RegexNode):
-    def __init__(self, options, is_inverted=False):
+    _kind = CHAR_SET
+    is_atom = True
+    _fields = ("is_inverted", "options")
+    __slots__ = _fields
+    _constructor_fields = ("options", "is_inverted")
+
+    def __init__(self, options: list, is_inverted: bool = False):
         self.is_inverted = is_inverted
         self.options = options
+        self._regex_cache = None
+
+    def _merge_ranges(self, options):
+        """Merge overlapping and adjacent ranges, and remove chars that are already included
+        [a-mh-z] --> [a-z]
+        [a-z0-9b] --> [a-z0-9]
+        [abcdef] --> [a-f]
+        """
+        intervals = []
+        merged = []
+
+        for index, option in enumerate(options):
+            bounds = _bounds_of(option)
+
+            if bounds is None:
+                # Options like \d are kept as they are
+                merged.append((index, option))
+                continue
+
+            intervals.append((bounds[0], bounds[1], index, option))
+
+        intervals.sort(key=lambda interval: interval[:3])
+
+        # Each group is a list of [lo, hi, members]
+        groups = []
+
+        for lo, hi, index, option in intervals:
+            if groups:
+                group = groups[-1]
+                overlaps = lo <= group[1]
+                is_adjacent = lo == group[1] + 1 and _range_class(lo) is not None \
+                    and _range_class(lo) == _range_class(group[1])
+
+                if overlaps or is_adjacent:
+                    group[1] = max(group[1], hi)
+                    group[2].append((index, option))
+                    continue
+
+            groups.append([lo, hi, [(index, option)]])
+
+        for lo, hi, members in groups:
+            first_index = min(index for index, _ in members)
+
+            if len(members) == 1:
+                merged.append(members[0])
+
+            elif any(option._kind == RANGE for _, option in members) or hi - lo >= 3:
+                # A range is only shorter than the single chars if there are at least 4 of them
+                merged.append((first_index, Range(_escaped_in_char_set(lo), _escaped_in_char_set(hi))))
+
+            else:
+                # Only keep one spelling of each char, e.g. for [.\.]. The escaped spelling is
+                # preferred, as a raw - or ^ can have a special meaning depending on its position
+                spellings = {}
+                for index, option in sorted(members, key=lambda member: member[0]):
+                    code_point = _bounds_of(option)[0]
+                    if code_point not in spellings:
+                        spellings[code_point] = (index, option)
+                    elif option.char.startswith("\\"):
+                        spellings[code_point] = (spellings[code_point][0], option)
+
+                merged.extend(spellings.values())
+
+        merged.sort(key=lambda member: member[0])
+        return [option for _, option in merged]
 
     def optimised(self) -> "RegexNode":
         if len(self.options) == 0:
-            return EmptyNode()
+            return EMPTY_NODE
 
-        unique_options = list(OrderedSet(self.options))
+        # [*-0] matches the chars from * to 0, so the - can not be handled like a literal
+        options = _explicit_ranges(self.options)
+        if options is None:
+            return self
 
-        if len(unique_options) == 1 and type(unique_options[0]) is SingleChar:
+        unique_options = list(OrderedSet(option.optimised() for option in options))
+        unique_options = self._merge_ranges(unique_options)
+
+        # [a] --> a, but [.] must stay as it is, as . has a different meaning outside of char sets
+        if len(unique_options) == 1 and not self.is_inverted \
+                and unique_options[0]._kind == SINGLE_CHAR and unique_options[0].is_literal:
             return unique_options[0]
 
-        # TODO: Remove single chars that are already included in a range
+        if _are_same_nodes(unique_options, self.options):
+            return self
 
         return CharSet(unique_options, self.is_inverted)
 
-    def merge_with(self, node):
-        if type(node) is CharSet:
-            if len(self.options) == 0:
-                self.is_inverted = node.is_inverted
+    def merge_with(self, node: "RegexNode") -> bool:
+        # This is the only node that is modified in place, so drop the values cached so far
+        self._regex_cache = None
+        self._hash = None
 
-            if self.is_inverted and node.is_inverted:
-                self_unique = OrderedSet(self.options)
-                other_unique = OrderedSet(node.options)
+        if node._kind == SINGLE_CHAR:
+            char = cast(SingleChar, node)
+            if not char.can_be_in_char_set:
+                return False
+            other = CharSet([char.in_char_set()])
 
-                # [^abc] + [^bc] --> [^a]
-                merged_options = self_unique.symmetric_difference(other_unique)
-                self.options = list(merged_options)
-                return True
+        elif node._kind == CHAR_SET:
+            other = cast(CharSet, node)
 
-            if not self.is_inverted and not node.is_inverted:
-                self.options.extend(node.options)
-                return True
+        else:
+            return False
 
+        # A raw - between two options is a range operator, which would be lost when the options are moved
+        if _has_unparsed_range(self.options) or _has_unparsed_range(other.options):
             return False
 
-        if not self.is_inverted and type(node) is SingleChar:
-            self.options.append(node)
+        # Only a leading or trailing - is left, which has to be escaped to stay a literal in the merged set
+        options = [option.in_char_set() if option._kind == SINGLE_CHAR else option for option in other.options]
+
+        if len(self.options) == 0:
+            self.is_inverted = other.is_inverted
+            self.options = options
+            return True
+
+        if not self.is_inverted and not other.is_inverted:
+            self.options.extend(options)
             return True
 
-        return False
+        # Inverted sets can only be combined by computing which chars they match
+        own_intervals = _intervals_of(self.options)
+        other_intervals = _intervals_of(other.options)
+
+        if own_intervals is None or other_intervals is None:
+            return False
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        pattern = ''.join([option.regex() for option in self.options])
+        if self.is_inverted and other.is_inverted:
+            # [^abc] | [^bc] --> [^bc]
+            intervals = _intersect_intervals(own_intervals, other_intervals)
+        elif self.is_inverted:
+            # [^abc] | a --> [^bc]
+            intervals = _subtract_intervals(own_intervals, other_intervals)
+        else:
+            intervals = _subtract_intervals(other_intervals, own_intervals)
+
+        # [^a] | a would match every char, which can not be written as a char set
+        if len(intervals) == 0:
+            return False
+
+        self.is_inverted = True
+        self.options = _options_for(intervals)
+        return True
 
-        if self.is_inverted:
-            pattern = "^" + pattern
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        if len(self.options) == 0 and not self.is_inverted:
+            return
 
-        if len(pattern) == 0:
-            return ""
+        buffer.append("[^" if self.is_inverted else "[")
 
-        return f"[{pattern}]"
+        for option in self.options:
+            option._emit(buffer)
+
+        buffer.append("]")
 
 
-# TODO: Add optimisation
 class Range (RegexNode):
-    def __init__(self, from_char, to_char):
+    _kind = RANGE
+    _fields = ("from_char", "to_char")
+    __slots__ = _fields
+
+    def __init__(self, from_char: str, to_char: str):
         self.from_char = from_char
         self.to_char = to_char
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
         if self.from_char == self.to_char:
             return SingleChar(self.from_char)
         return self
 
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        return self.from_char + "-" + self.to_char
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        buffer.extend((self.from_char, "-", self.to_char))
 
 
 class RepeatExactlyN (RegexNode):
-    def __init__(self, pattern, n, is_lazy=False):
+    _kind = REPEAT_EXACTLY_N
+    _fields = ("pattern", "n", "is_lazy")
+    __slots__ = _fields
+
+    def __init__(self, pattern: "RegexNode", n: int, is_lazy: bool = False):
         self.pattern = pattern
         self.n = n
         self.is_lazy = is_lazy
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        if type(self.pattern) is EmptyNode:
-            return EmptyNode()
+        if self.pattern._kind == EMPTY:
+            return EMPTY_NODE
 
         if self.n == 0:
-            return EmptyNode()
+            return EMPTY_NODE
 
         optimised = self.pattern.optimised()
 
         if self.n == 1:
             return optimised
 
-        return RepeatExactlyN(optimised, self.n, self.is_lazy)
-
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        regex = self.pattern.regex(as_atom=True)
-
-        if regex == "":
-            return ""
-
-        regex += "{" + str(self.n) + "}"
+        if optimised is self.pattern:
+            return self
 
-        if self.is_lazy:
-            regex += "?"
+        return RepeatExactlyN(optimised, self.n, self.is_lazy)
 
-        if as_atom:
-            return "(?:" + regex + ")"
-        return regex
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "{" + str(self.n) + "}", self.is_lazy, as_atom)
 
 
 class RepeatAtLeastN (RegexNode):
-    def __init__(self, pattern, n, is_lazy):
+    _kind = REPEAT_AT_LEAST_N
+    _fields = ("pattern", "n", "is_lazy")
+    __slots__ = _fields
+
+    def __init__(self, pattern: "RegexNode", n: int, is_lazy: bool):
         self.pattern = pattern
         self.n = n
         self.is_lazy = is_lazy
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        if type(self.pattern) is EmptyNode:
-            return EmptyNode()
+        if self.pattern._kind == EMPTY:
+            return EMPTY_NODE
 
         optimised = self.pattern.optimised()
 
@@ -590,70 +1422,62 @@ class RepeatAtLeastN (RegexNode):
         if self.n == 1:
             return OneOrMore(optimised)
 
-        return RepeatAtLeastN(optimised, self.n, self.is_lazy)
-
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        regex = self.pattern.regex(as_atom=True)
-
-        if regex == "":
-            return ""
-
-        regex += "{" + str(self.n) + ",}"
+        if optimised is self.pattern:
+            return self
 
-        if self.is_lazy:
-            regex += "?"
+        return RepeatAtLeastN(optimised, self.n, self.is_lazy)
 
-        if as_atom:
-            return "(?:" + regex + ")"
-        return regex
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "{" + str(self.n) + ",}", self.is_lazy, as_atom)
 
 
 class RepeatAtMostN (RegexNode):
-    def __init__(self, pattern, n, is_lazy=False):
+    _kind = REPEAT_AT_MOST_N
+    _fields = ("pattern", "n", "is_lazy")
+    __slots__ = _fields
+
+    def __init__(self, pattern: "RegexNode", n: int, is_lazy: bool = False):
         self.pattern = pattern
         self.n = n
         self.is_lazy = is_lazy
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        if type(self.pattern) is EmptyNode:
-            return EmptyNode()
+        if self.pattern._kind == EMPTY:
+            return EMPTY_NODE
 
         if self.n == 0:
-            return EmptyNode()
+            return EMPTY_NODE
 
         optimised = self.pattern.optimised()
 
         if self.n == 1:
             return optimised
 
-        return RepeatAtMostN(optimised, self.n, self.is_lazy)
-
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        regex = self.pattern.regex(as_atom=True)
-
-        if regex == "":
-            return ""
-
-        regex += "{," + str(self.n) + "}"
+        if optimised is self.pattern:
+            return self
 
-        if self.is_lazy:
-            regex += "?"
+        return RepeatAtMostN(optimised, self.n, self.is_lazy)
 
-        if as_atom:
-            return "(?:" + regex + ")"
-        return regex
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "{," + str(self.n) + "}", self.is_lazy, as_atom)
 
 
 class RepeatBetweenNM (RegexNode):
-    def __init__(self, pattern, n, m, is_lazy=False):
+    _kind = REPEAT_BETWEEN_N_M
+    _fields = ("pattern", "n", "m", "is_lazy")
+    __slots__ = _fields
+
+    def __init__(self, pattern: "RegexNode", n: int, m: int, is_lazy: bool = False):
         self.pattern = pattern
         self.n = n
         self.m = m
         self.is_lazy = is_lazy
+        self._regex_cache = None
 
     def optimised(self) -> "RegexNode":
-        if type(self.pattern) is EmptyNode:
-            return EmptyNode()
+        if self.pattern._kind == EMPTY:
+            return EMPTY_NODE
 
         optimised = self.pattern.optimised()
 
@@ -661,24 +1485,15 @@ class RepeatBetweenNM (RegexNode):
             return RepeatExactlyN(optimised, self.n, is_lazy=self.is_lazy)
 
         if self.m == 0:
-            return EmptyNode()
+            return EMPTY_NODE
 
         if self.m == 1:
             return Optional(optimised, is_lazy=self.n==0)
 
-        return RepeatBetweenNM(optimised, self.n, self.m, self.is_lazy)
-
-    def regex(self, as_atom=False, in_sequence=True) -> str:
-        regex = self.pattern.regex(as_atom=True)
+        if optimised is self.pattern:
+            return self
 
-        if regex == "":
-            return ""
-
-        regex += "{" + str(self.n) + "," + str(self.m) + "}"
-
-        if self.is_lazy:
-            regex += "?"
+        return RepeatBetweenNM(optimised, self.n, self.m, self.is_lazy)
 
-        if as_atom:
-            return "(?:" + regex + ")"
-        return regex
+    def _emit(self, buffer: list, as_atom: bool = False, in_sequence: bool = True):
+        _emit_quantified(buffer, self.pattern, "{" + str(self.n) + "," + str(self.m) + "}", self.is_lazy, as_atom)
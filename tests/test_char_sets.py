@@ -0,0 +1,40 @@
+import re
+import unittest
+
+from rebuild.builder import optimise
+
+
+def _matched_chars(regex):
+    return [chr(code_point) for code_point in range(256) if re.fullmatch(regex, chr(code_point))]
+
+
+class TestCharSetRanges (unittest.TestCase):
+    def assert_same_matches(self, regex):
+        optimised = optimise(regex)
+        self.assertEqual(_matched_chars(regex), _matched_chars(optimised), optimised)
+        return optimised
+
+    def test_range_not_parsed_as_range(self):
+        # The parser only creates ranges like a-z, so the - in *-0 reaches the analyser as a char
+        self.assertEqual(self.assert_same_matches("[*-01234]"), "[*-4]")
+
+    def test_dash_after_range_is_literal(self):
+        self.assert_same_matches("[*-0-4]")
+        self.assert_same_matches("[a-z-9]")
+
+    def test_leading_and_trailing_dash(self):
+        self.assert_same_matches("[-a]")
+        self.assert_same_matches("[a-]")
+
+    def test_merged_sets_keep_ranges(self):
+        self.assertEqual(self.assert_same_matches("[!-/]|a"), "[!-/a]")
+        self.assert_same_matches("[ -~]|\n")
+        self.assert_same_matches("[^!-/]|a")
+
+    def test_merged_sets_escape_dash(self):
+        self.assertEqual(self.assert_same_matches("(?:x|[-a])"), "[x\\-a]")
+        self.assert_same_matches("(?:x|[a-])")
+
+
+if __name__ == "__main__":
+    unittest.main()